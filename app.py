@@ -1,20 +1,42 @@
 # app.py
 import streamlit as st
 import pandas as pd
-from rapidfuzz import process, fuzz
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from rapidfuzz import process, fuzz, utils
+import marisa_trie
 import html
+import os
+import bisect
+import hashlib
 
 # ---------- CONFIG ----------
 DATAFILE = "karnataka_schools.xlsx"   # put file in repo root for Streamlit Cloud / Colab
+CACHE_VERSION = 2                     # bump whenever reading or _normalize_df changes, so old sidecars are ignored
+CACHEFILE = f"karnataka_schools.v{CACHE_VERSION}.parquet"  # columnar copy written on first load (much faster to read)
 SCORE_THRESHOLD = 75                  # high tolerance (less results, more accurate)
 MAX_RESULTS = 5
+MIN_QUERY_LEN = 3                     # shorter queries match too broadly to be worth scoring
+PARALLEL_MIN_CHOICES = 2000           # below this, thread start-up costs more than it saves
+PREFIX_WALK_LIMIT = 500               # most names scored per prefix query (e.g. "govt" starts ~14k names)
+COLUMNS = ['school_name','village','district','block','state_mgmt','school_category','school_type','school_status','udise_code']
+CATEGORY_COLUMNS = ['district','block','state_mgmt','school_category','school_type','school_status']  # low cardinality
+ESCAPED_COLUMNS = ['school_name','district','block','village','mgmt_label','school_status','udise_code']  # shown in the detail card
+UDISE_URL = "https://udiseplus.gov.in/school/SchoolDirectory?udisecode="
+# fields kept for display; everything else is only needed while building the search index
+TABLE_COLUMNS = ['school_name','village','block','district','mgmt_label','school_status','udise_code'] + \
+    [c + '_esc' for c in ESCAPED_COLUMNS] + ['udise_url']
 # ----------------------------
 
 st.set_page_config(page_title="Karnataka School Finder", layout="wide")
 
-# ---------- Blue official CSS ----------
-st.markdown(
-    """
+# ---------- Blue official CSS + page header ----------
+@st.cache_resource
+def get_static_html():
+    # built once per process; emitted as a single element per run
+    # (streamlit clears elements a rerun does not re-send, so it cannot be skipped)
+    return """
     <style>
         .stApp { background-color: #ffffff; }
         .header { font-size:28px; font-weight:700; color:#0A3D62; margin-bottom:6px; }
@@ -30,76 +52,126 @@ st.markdown(
         .label { color:#0A3D62; font-weight:600; }
         .small { font-size:13px; color:#444; }
     </style>
-    """,
-    unsafe_allow_html=True,
-)
+    <div class="header">Karnataka School Finder</div>
+    <div class="sub">Select a district, type a school name (typos allowed). Pick a school from the results to view details.</div>
+    """
+
+st.markdown(get_static_html(), unsafe_allow_html=True)
+
+# ---------- Management mapping (clean labels) ----------
+# checked in order, first match wins
+MGMT_PATTERNS = [
+    ('Government', r'department of education|dept of education'),
+    ('Private Aided', r'private.*aided|aided.*private'),
+    ('Private Unaided', r'private|unaided'),
+    ('Government Aided', r'aided'),
+    ('Central Government', r'central|kvs|navodaya'),
+    ('Local Body', r'local|panchayat|municipal'),
+]
 
-st.markdown('<div class="header">Karnataka School Finder</div>', unsafe_allow_html=True)
-st.markdown('<div class="sub">Select a district, type a school name (typos allowed). Click a school to view details.</div>', unsafe_allow_html=True)
+def map_management(mgmt):
+    # classify each distinct state_mgmt value once with np.select, then broadcast to the rows
+    raw = pd.Series(mgmt.astype(str).unique())
+    r = raw.str.strip().str.lower()
+    conds = [r.str.contains(p, regex=True) for _, p in MGMT_PATTERNS]
+    # plain "education" means Government unless the value mentions private
+    conds[0] = conds[0] | (r.str.contains('education', regex=False) & ~r.str.contains('private', regex=False))
+    labels = np.select([r == ""] + conds, ["Not available"] + [label for label, _ in MGMT_PATTERNS],
+                       default=raw.str.strip().str.title())
+    return mgmt.astype(str).map(dict(zip(raw, labels))).astype('category')
 
 # ---------- Load data ----------
+def read_schools_excel(path):
+    # read only the columns the app uses, as text (keeps UDISE codes intact); calamine is much faster than openpyxl
+    return pd.read_excel(path, usecols=lambda c: str(c).strip() in COLUMNS, dtype=str, engine="calamine")
+
+def _normalize_df(df_local):
+    # shared by the bundled file and uploads: trimmed text in exactly COLUMNS (missing columns and blank cells become "")
+    df_local.columns = df_local.columns.str.strip()
+    df_local = df_local.assign(**{c: df_local[c].fillna("").astype(str).str.strip() if c in df_local.columns else "" for c in COLUMNS})
+    # repeated labels are stored as categories
+    return df_local[COLUMNS].astype({c: 'category' for c in CATEGORY_COLUMNS})
+
+def add_derived_columns(df_local):
+    df_local['mgmt_label'] = map_management(df_local['state_mgmt'])
+    # display values escaped once here instead of on every render
+    for c in ESCAPED_COLUMNS:
+        df_local[c + '_esc'] = df_local[c].map(html.escape, na_action='ignore')
+    df_local['udise_url'] = UDISE_URL + df_local['udise_code_esc']
+    return df_local
+
+def to_search_data(df_local):
+    # compact payload for st.cache_data: an arrow table of the displayed fields plus the arrays the
+    # search index is built from (arrow buffers pickle far faster than a wide object DataFrame)
+    df_local = add_derived_columns(df_local)
+    table = pa.Table.from_pandas(df_local[TABLE_COLUMNS], preserve_index=False)
+    district = pc.cast(table.column('district'), pa.string()).combine_chunks()
+    return {
+        'table': table,
+        'names_lower': pa.array(df_local['school_name'].str.lower(), type=pa.string()),
+        'district_lower': pc.utf8_lower(pc.utf8_trim_whitespace(district)),  # normalized once, with arrow kernels
+        'districts': sorted(df_local['district'].dropna().unique().tolist()),
+    }
+
 @st.cache_data
-def load_data(path=DATAFILE):
+def load_data(path=DATAFILE, cache_path=CACHEFILE):
+    # fast path: reuse the parquet copy unless the Excel file is newer
+    if os.path.exists(cache_path) and not (os.path.exists(path) and os.path.getmtime(path) > os.path.getmtime(cache_path)):
+        try:
+            df_local = pd.read_parquet(cache_path, columns=COLUMNS, engine="pyarrow")
+        except Exception:
+            df_local = None  # unreadable cache -> rebuild from Excel below
+        if df_local is not None:
+            return to_search_data(df_local)
     try:
-        df_local = pd.read_excel(path)
+        df_local = read_schools_excel(path)
     except Exception:
-        return pd.DataFrame()
-    # drop unnamed index cols
-    df_local = df_local.loc[:, ~df_local.columns.str.contains('^Unnamed')]
-    # normalize column names & whitespace
-    df_local.columns = df_local.columns.str.strip()
-    # ensure expected columns exist
-    for c in ['school_name','village','district','block','state_mgmt','school_category','school_type','school_status','udise_code']:
-        if c in df_local.columns:
-            df_local[c] = df_local[c].astype(str).str.strip()
-        else:
-            df_local[c] = ""
-    # lowercase helper columns for matching
-    df_local['school_name_lower'] = df_local['school_name'].str.lower()
-    df_local['village_lower'] = df_local['village'].str.lower()
-    return df_local
+        return None
+    df_local = _normalize_df(df_local)
+    try:
+        df_local.to_parquet(cache_path, compression="zstd", index=False)
+    except Exception:
+        pass  # read-only filesystem: keep serving from memory
+    return to_search_data(df_local)
 
-df = load_data()
+data = load_data()
+source = DATAFILE  # identifies the loaded dataset for the cached search index
 
 # If dataset not found in repo root, show uploader
-if df.empty:
+if data is None:
     st.warning("Dataset not found in app root. Please upload `karnataka_schools.xlsx` (Excel file).")
     uploaded = st.file_uploader("Upload Karnataka Excel file", type=["xlsx"])
     if uploaded:
-        df = pd.read_excel(uploaded)
-        df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
-        df.columns = df.columns.str.strip()
-        for c in ['school_name','village','district','block','state_mgmt','school_category','school_type','school_status','udise_code']:
-            if c in df.columns:
-                df[c] = df[c].astype(str).str.strip()
-            else:
-                df[c] = ""
-        df['school_name_lower'] = df['school_name'].str.lower()
-        df['village_lower'] = df['village'].str.lower()
+        source = f"upload:{hashlib.sha1(uploaded.getvalue()).hexdigest()}"  # content hash: same-named edits get fresh caches
+        data = to_search_data(_normalize_df(read_schools_excel(uploaded)))
+    else:
+        st.stop()
 
-# ---------- Management mapping (clean labels) ----------
-def map_management(raw):
-    if not raw or str(raw).strip() == "":
-        return "Not available"
-    r = str(raw).strip().lower()
-    # common patterns -> normalized label
-    if "department of education" in r or "dept of education" in r or "education" in r and "private" not in r:
-        return "Government"
-    if "private" in r and "aided" in r:
-        return "Private Aided"
-    if "private" in r or "unaided" in r or "unaided" in r:
-        return "Private Unaided"
-    if "aided" in r and "private" not in r:
-        return "Government Aided"
-    if "central" in r or "kvs" in r or "navodaya" in r or "central government" in r:
-        return "Central Government"
-    if "local" in r or "panchayat" in r or "municipal" in r or "local body" in r:
-        return "Local Body"
-    # fallback: capitalize words
-    return str(raw).strip().title()
+# ---------- Search index (built once per dataset, shared across reruns) ----------
+# python-side lookup structures live in cache_resource (shared, never pickled)
+@st.cache_resource(show_spinner=False)
+def build_index(_data, source):
+    # `source` identifies the dataset; the data itself is not hashed
+    district_lower = _data['district_lower']
+    names_lower = pd.Series(_data['names_lower'].to_pylist())
+    names_list = names_lower.tolist()
+    return {
+        'names_list': names_list,
+        'names_processed': [utils.default_process(n) for n in names_list],  # scorer input: plain list, punctuation stripped once
+        'names_arrow': _data['names_lower'],  # for arrow's substring kernel
+        # district -> row positions, filtered in arrow once per district rather than on every query
+        'district_index': {d: pc.indices_nonzero(pc.equal(district_lower, d)).to_numpy().astype(np.intp)
+                           for d in pc.unique(district_lower).drop_null().to_pylist()},
+        'row_district': district_lower.to_numpy(zero_copy_only=False),  # row position -> district
+        'name_to_rows': names_lower.groupby(names_lower).indices,  # exact name -> row positions
+        'names_sorted': sorted(set(names_list)),  # for prefix lookups with bisect
+        'trie': marisa_trie.Trie(names_list),  # candidate names for the fuzzy fallback
+    }
+
+index = build_index(data, source)
 
 # ---------- UI controls ----------
-districts = sorted(df['district'].dropna().unique().tolist())
+districts = data['districts']
 districts_display = ["All Districts"] + districts
 selected_district = st.selectbox("Select District:", districts_display, index=0)
 
@@ -107,72 +179,158 @@ school_query = st.text_input("School name (type partial name; typos allowed):")
 
 st.write("---")
 
-# ---------- Helper: fuzzy search inside a df subset ----------
-def fuzzy_search_in_df(name_query, df_subset, threshold=SCORE_THRESHOLD, max_results=MAX_RESULTS):
-    if name_query is None or name_query.strip() == "":
-        return pd.DataFrame()
-    choices = df_subset['school_name'].dropna().tolist()
-    matches = process.extract(name_query, choices, scorer=fuzz.WRatio, limit=200)
-    good = [m for m in matches if m[1] >= threshold]
-    good_sorted = sorted(good, key=lambda x: x[1], reverse=True)[:max_results]
-    if not good_sorted:
+# ---------- Helper: fuzzy search over candidate rows ----------
+def top_matches(query, choices, scorer, threshold=SCORE_THRESHOLD, max_results=MAX_RESULTS):
+    # score all choices in one batched cdist call; returns (positions, scores), best first
+    # workers=-1 spreads large lists over all cores (rapidfuzz releases the GIL)
+    workers = -1 if len(choices) > PARALLEL_MIN_CHOICES else 1
+    scores = process.cdist([query], choices, scorer=scorer, score_cutoff=threshold, workers=workers)[0]
+    hits = np.flatnonzero(scores)  # scores below the cutoff come back as 0
+    if len(hits) > max_results:
+        # k-th best score via partition; ties on it are filled in row order, like process.extract
+        kth = np.partition(scores[hits], -max_results)[-max_results]
+        better = hits[scores[hits] > kth]
+        tied = hits[scores[hits] == kth][:max_results - len(better)]
+        hits = np.concatenate([better, tied])
+    hits = hits[np.argsort(-scores[hits], kind='stable')]
+    return hits, scores[hits]
+
+def fuzzy_search_rows(name_query, rows=None, threshold=SCORE_THRESHOLD, max_results=MAX_RESULTS):
+    # rows: candidate row positions (None = every school); returns (rows, scores), best first
+    names = index['names_processed']
+    choices = names if rows is None else [names[i] for i in rows]
+    query = utils.default_process(name_query)
+    positions, scores = top_matches(query, choices, fuzz.token_set_ratio, threshold, max_results)
+    if len(positions) == 0:
+        # token_set_ratio is one scorer; WRatio blends four, so it only runs when the cheap pass finds nothing
+        positions, scores = top_matches(query, choices, fuzz.WRatio, threshold, max_results)
+    # positions index into `choices`; map them back to row positions
+    return (positions if rows is None else np.asarray(rows)[positions]), scores
+
+# ---------- Helper: exact / prefix lookup (no fuzzy scoring needed) ----------
+def exact_or_prefix_search(q, district_key=None, threshold=SCORE_THRESHOLD, max_results=MAX_RESULTS):
+    # q is lowercased; district_key limits hits to one district (None = all)
+    name_to_rows = index['name_to_rows']
+    row_district = index['row_district']
+    names_sorted = index['names_sorted']
+    def in_scope(name):
+        return [r for r in name_to_rows[name] if district_key is None or row_district[r] == district_key]
+    # exact name first, then the sorted names that start with q, each with all of its in-scope rows
+    # (same-name schools in different villages); names scoring below the threshold are skipped like
+    # fuzzy hits, so a walk that finds none falls through to the fuzzy path
+    names = index['names_list']
+    rows, scores = [], []
+    def add(name):
+        hits = in_scope(name)
+        if hits:
+            score = fuzz.WRatio(q, names[hits[0]])
+            if score >= threshold:
+                hits = hits[:max_results - len(rows)]
+                rows.extend(hits)
+                scores.extend([score] * len(hits))
+    if q in name_to_rows:
+        add(q)
+    i = bisect.bisect_right(names_sorted, q)
+    end = min(len(names_sorted), i + PREFIX_WALK_LIMIT)
+    while i < end and names_sorted[i].startswith(q) and len(rows) < max_results:
+        add(names_sorted[i])
+        i += 1
+    # returns (rows, scores), best first
+    scores = np.array(scores)
+    order = np.argsort(-scores, kind='stable')
+    return np.array(rows, dtype=np.intp)[order], scores[order]
+
+# ---------- Helper: trie candidates for the fuzzy fallback ----------
+def trie_candidates(q, district_key=None):
+    # row positions of names sharing q's prefix, leaving the last two characters free for typos
+    name_to_rows = index['name_to_rows']
+    row_district = index['row_district']
+    prefix = q[:max(1, len(q) - 2)]
+    return [r for name in index['trie'].keys(prefix) for r in name_to_rows[name]
+            if district_key is None or row_district[r] == district_key]
+
+# ---------- Search pipeline (results cached per dataset / district / query) ----------
+@st.cache_data(max_entries=2048, show_spinner=False)
+def fuzzy_search(q, district, source):
+    # `source` keys the cache per dataset; the rows come from the module-level data / index
+    return _fuzzy_search_impl(q, district)
+
+def _fuzzy_search_impl(q, district):
+    if district == "All Districts":
+        district_key = None
+        rows = None
+    else:
+        district_key = district.strip().lower()
+        rows = index['district_index'].get(district_key)
+        if rows is None:
+            return pd.DataFrame()
+    hits, scores = exact_or_prefix_search(q, district_key)
+    if len(hits) == 0:
+        # no exact/prefix hit: fuzzy match, preferring names that contain the query
+        names_arrow = index['names_arrow'] if rows is None else index['names_arrow'].take(rows)
+        # plain substring match (no regex) on the already-lowercased names
+        mask = pc.match_substring(names_arrow, q).to_numpy(zero_copy_only=False)
+        partials = np.flatnonzero(mask) if rows is None else rows[mask]
+        if len(partials):
+            hits, scores = fuzzy_search_rows(q, partials)
+        else:
+            # score only trie-reachable names first; scan the whole district if that finds nothing
+            candidates = trie_candidates(q, district_key)
+            if candidates:
+                hits, scores = fuzzy_search_rows(q, candidates)
+            if len(hits) == 0:
+                hits, scores = fuzzy_search_rows(q, rows)
+    if len(hits) == 0:
         return pd.DataFrame()
-    matched_names = [m[0] for m in good_sorted]
-    score_map = {m[0]: m[1] for m in good_sorted}
-    result_rows = df_subset[df_subset['school_name'].isin(matched_names)].copy()
-    result_rows['match_score'] = result_rows['school_name'].map(score_map).fillna(0).astype(int)
-    result_rows = result_rows.sort_values(by='match_score', ascending=False)
-    result_rows = result_rows.drop_duplicates(subset=['school_name'], keep='first')
-    return result_rows
+    # only the matched rows are turned into a (small) DataFrame
+    return data['table'].take(hits).to_pandas().assign(match_score=scores.astype(int))
 
 # ---------- Perform search ----------
 results = pd.DataFrame()
-if school_query and df.shape[0] > 0:
-    if selected_district != "All Districts":
-        subset = df[df['district'].astype(str).str.strip().str.lower() == selected_district.strip().lower()]
-    else:
-        subset = df.copy()
-    if subset.empty:
+q = school_query.strip().lower()
+search_key = (source, selected_district, q)
+if len(q) >= MIN_QUERY_LEN and data['table'].num_rows > 0:
+    if selected_district != "All Districts" and selected_district.strip().lower() not in index['district_index']:
         st.info("No schools found in selected district. Try 'All Districts' or different district.")
+    elif st.session_state.get('last_search') == search_key:
+        # rerun without a new query (e.g. picking a school for details): reuse the previous results
+        results = st.session_state.last_results
     else:
-        q = school_query.strip().lower()
-        partials = subset[subset['school_name_lower'].str.contains(q, na=False)]
-        if not partials.empty:
-            results = fuzzy_search_in_df(school_query, partials, threshold=SCORE_THRESHOLD, max_results=MAX_RESULTS)
-        else:
-            results = fuzzy_search_in_df(school_query, subset, threshold=SCORE_THRESHOLD, max_results=MAX_RESULTS)
+        results = fuzzy_search(q, selected_district, source)
+        st.session_state.last_search = search_key
+        st.session_state.last_results = results
+
+# ---------- Display results: one table + details for the selected school ----------
+DISPLAY_COLUMNS = {
+    'school_name': "School Name",
+    'village': "Village",
+    'block': "Block",
+    'district': "District",
+    'mgmt_label': "Management",
+    'school_status': "Status",
+    'udise_code': "UDISE",
+    'match_score': "Match %",
+}
 
-# ---------- Display results as clickable expanders ----------
 if results.empty:
-    if school_query:
+    if q and len(q) < MIN_QUERY_LEN:
+        st.info(f"Type at least {MIN_QUERY_LEN} characters of the school name.")
+    elif school_query:
         st.warning(f"No strong matches found (≥ {SCORE_THRESHOLD}%). Try adding more of the name or change district.")
     else:
         st.info("Select a district and type a school name to start searching.")
 else:
     st.success(f"Showing {min(len(results), MAX_RESULTS)} best match(es) (confidence % shown).")
-    # for readability: loop through rows and build expanders
-    for _, row in results.iterrows():
-        name = row['school_name']
-        score = int(row.get('match_score', 0))
-        village = row.get('village', "")
-        block = row.get('block', "")
-        district = row.get('district', "")
-        udise = row.get('udise_code', "")
-        management_raw = row.get('state_mgmt', "")
-        management = map_management(management_raw)
-        status = row.get('school_status', "")
-        header = f"{name}  —  {village if village else block if block else district}  ({score}%)"
-        with st.expander(header):
-            # show minimal official fields in two columns
-            col1, col2 = st.columns([2,1])
-            with col1:
-                st.markdown(f"**School Name:** {html.escape(str(name))}")
-                st.markdown(f"**District:** {html.escape(str(district))}")
-                st.markdown(f"**Block:** {html.escape(str(block))}")
-                st.markdown(f"**Village:** {html.escape(str(village))}")
-            with col2:
-                st.markdown(f"**Management:** {html.escape(str(management))}")
-                st.markdown(f"**Status:** {html.escape(str(status))}")
-                st.markdown(f"**UDISE:** {html.escape(str(udise))}")
-            # small note
-            st.markdown('<div class="small">If details look incorrect, try selecting a different district or refine the school name.</div>', unsafe_allow_html=True)
+    st.dataframe(results[list(DISPLAY_COLUMNS)].rename(columns=DISPLAY_COLUMNS), width="stretch", hide_index=True)
+    labels = [f"{name}  —  {village or block or district}  ({score}%)"
+              for name, village, block, district, score in zip(results['school_name'], results['village'], results['block'],
+                                                              results['district'], results['match_score'])]
+    choice = st.selectbox("View details for:", range(len(labels)), format_func=labels.__getitem__)
+    chosen = results.iloc[choice]
+    fields = [("School Name", chosen['school_name_esc']), ("District", chosen['district_esc']), ("Block", chosen['block_esc']),
+              ("Village", chosen['village_esc']), ("Management", chosen['mgmt_label_esc']), ("Status", chosen['school_status_esc']),
+              ("UDISE", f'<a href="{chosen["udise_url"]}" target="_blank">{chosen["udise_code_esc"]}</a>')]
+    card = "".join(f'<div><span class="label">{label}:</span> {value}</div>' for label, value in fields)
+    st.markdown(f'<div class="card">{card}</div>', unsafe_allow_html=True)
+    # small note
+    st.markdown('<div class="small">If details look incorrect, try selecting a different district or refine the school name.</div>', unsafe_allow_html=True)